@@ -1,7 +1,12 @@
-import json
+from collections import Counter, defaultdict
+import multiprocessing
+
+import ijson
 
 from models import Document, PositionalInvertedIndexOnMemory, IRData
 import optimizer
+import score_weight
+import tokenizer
 
 
 def load_documents(file) -> list[Document]:
@@ -36,55 +41,122 @@ def load_documents(file) -> list[Document]:
         },
         ...
     }
-    """
-    with open(file, 'r', encoding='utf-8') as f:
-        json_data = json.load(f)
 
+    The file is parsed incrementally, so the decoded JSON object of the whole corpus
+    is never held in memory next to the created Document objects. Only if ijson has no
+    compiled backend the file is decoded at once with orjson, as the pure-Python
+    backend is many times slower; orjson is only imported (and required) in that case.
+    """
     docs = []
-    for docId, data in json_data.items():
-        docs.append(
-            Document(
-                doc_id=docId,
-                title=data["title"],
-                url=data["url"],
-                content=data["content"],
-                date=data["date"],
-                tags=data["tags"],
+    append = docs.append
+    with open(file, 'rb') as f:
+        if ijson.backend == 'python':
+            import orjson
+            items = orjson.loads(f.read()).items()
+        else:
+            items = ijson.kvitems(f, '')
+
+        for docId, data in items:
+            append(
+                Document(
+                    doc_id=docId,
+                    title=data["title"],
+                    url=data["url"],
+                    content=data["content"],
+                    date=data["date"],
+                    tags=data["tags"],
+                )
             )
-        )
 
     return docs
 
 
-def create_pii(docs: list[Document]) -> PositionalInvertedIndexOnMemory:
+def _add_content_tokens(pii: PositionalInvertedIndexOnMemory, doc_index, tokens):
     """
-    Creates a positional inverted index (PII) from a list of Document objects.
+    Adds the content tokens of a document to a positional inverted index (PII).
+
+    Positions are grouped by token first, so each token is added once per document.
+
+    Args:
+        pii (PositionalInvertedIndexOnMemory): The positional inverted index to add the tokens to.
+        doc_index (int): The index of the document.
+        tokens (Iterable[str]): The content tokens of the document, in order.
+    """
+    token_positions = defaultdict(list)
+    for i, token in enumerate(tokens):
+        token_positions[token].append(i)
+
+    for token, positions in token_positions.items():
+        pii.__add_positions__(
+            token_str=token,
+            doc_id=doc_index,
+            positions=positions,
+        )
+
+
+def _index_documents(docs: list[Document], start=0) -> PositionalInvertedIndexOnMemory:
+    """
+    Adds the tokens of a list of Document objects to a new positional inverted index (PII).
+
+    The contents of the documents are tokenized with `tokenizer.tokenize_batch`, one document at a time
+    as they are indexed.
 
     Args:
         docs (list[Document]): A list of Document objects representing the documents to be indexed.
+        start (int, optional): The index of the first document (defaults to 0).
 
     Returns:
-        PositionalInvertedIndexOnMemory: The created positional inverted index object.
+        PositionalInvertedIndexOnMemory: The created positional inverted index object, not finalized yet.
     """
     pii = PositionalInvertedIndexOnMemory()
-    for doc in docs:
-        for token, weight in doc.get_weighted_tokens():
-            pii.__add_token__(
+    contents_tokens = tokenizer.tokenize_batch(doc.content for doc in docs)
+    for doc_index, (doc, content_tokens) in enumerate(zip(docs, contents_tokens), start):
+        # Title and tag occurrences have no position, so each (token, weight) is added once with its count
+        for (token, weight), count in Counter(doc.get_weighted_tokens()).items():
+            pii.__add_token_bulk__(
                 token_str=token,
-                doc_id=doc.id,
-                position=-1,
+                doc_id=doc_index,
+                count=count,
                 weight=weight,
             )
 
-        tokens = doc.get_tokens()
-        for i in range(len(tokens)):
-            pii.__add_token__(
-                token_str=tokens[i],
-                doc_id=doc.id,
-                position=i,
-            )
+        _add_content_tokens(pii, doc_index, content_tokens)
 
-    pii.__finalize__(len(docs))
+    return pii
+
+
+def create_pii(docs: list[Document], processes=None) -> PositionalInvertedIndexOnMemory:
+    """
+    Creates a positional inverted index (PII) from a list of Document objects.
+
+    Documents are referred to in the index by their position in `docs`.
+    Tokenizing the documents is CPU-bound Python work, so with `processes` the documents are
+    split into contiguous shards that are indexed in parallel worker processes. The partial
+    indexes are then merged (in shard order) and finalized in the current process.
+    Terms appearing in more than `score_weight.MAX_DOCUMENT_FREQUENCY_RATIO` of the documents
+    (if set) are eliminated from the index.
+
+    Args:
+        docs (list[Document]): A list of Document objects representing the documents to be indexed.
+        processes (int, optional): The number of worker processes to index the documents with
+            (defaults to None, which indexes them in the current process).
+
+    Returns:
+        PositionalInvertedIndexOnMemory: The created positional inverted index object.
+    """
+    if processes is None or processes <= 1 or len(docs) <= 1:
+        pii = _index_documents(docs)
+    else:
+        shard_size = -(-len(docs) // processes)
+        shards = [(docs[i:i + shard_size], i) for i in range(0, len(docs), shard_size)]
+        with multiprocessing.Pool(len(shards)) as pool:
+            partials = pool.starmap(_index_documents, shards)
+
+        pii = partials[0]
+        for partial in partials[1:]:
+            pii.__merge__(partial)
+
+    pii.__finalize__(len(docs), score_weight.MAX_DOCUMENT_FREQUENCY_RATIO)
     return pii
 
 
@@ -92,28 +164,27 @@ def create_query_pii(query: str) -> PositionalInvertedIndexOnMemory:
     """
     Creates a positional inverted index for a given query string.
 
+    The query is indexed as the content of a single document (index 0), without going
+    through a Document object and its title/tag tokens.
+
     Args:
         query (str): The query string to be indexed.
 
     Returns:
         PositionalInvertedIndexOnMemory: The created positional inverted index object for the query.
     """
-    return create_pii([
-        Document(
-            doc_id="0",
-            title="",
-            url="",
-            content=query,
-            date=None
-        )
-    ])
+    pii = PositionalInvertedIndexOnMemory()
+    _add_content_tokens(pii, 0, tokenizer.tokenize(query))
+    pii.__finalize__(1)
+    return pii
 
 
-def create(file, cache=True, champions_list_r=None) -> IRData:
+def create(file, cache=True, champions_list_r=None, processes=None) -> IRData:
     """
     Creates an IRData object containing the positional inverted index (PII) and document data.
 
-    This function first attempts to read the PII from the cache. If successful, it uses the cached PII.
+    This function first attempts to read the PII from the cache. If successful (and the cache was created
+    from the same documents), it uses the cached PII.
     Otherwise, it creates the PII from the provided document data.
 
     Args:
@@ -121,22 +192,24 @@ def create(file, cache=True, champions_list_r=None) -> IRData:
         cache (bool, optional): Whether to use the cache for the PII (defaults to True).
         champions_list_r (int, optional): The number of top documents to include in champions lists
             for each term (used for ranking, defaults to None).
+        processes (int, optional): The number of worker processes used to create the PII
+            when it is not read from the cache (defaults to None, see `create_pii`).
 
     Returns:
         IRData: The created IRData object containing the PII and document data.
     """
     docs = load_documents(file)
     if cache:
-        cache_pii = optimizer.read_from_cache(file)
+        cache_pii = optimizer.read_from_cache(file, docs)
         if cache_pii is not None:
             ir = IRData(cache_pii, docs)
             optimizer.generate_champions_list(ir, champions_list_r)
             return ir
 
-    pii = create_pii(docs)
+    pii = create_pii(docs, processes)
 
     if cache:
-        optimizer.write_cache(pii, file)
+        optimizer.write_cache(pii, file, docs)
 
     ir = IRData(pii, docs)
     optimizer.generate_champions_list(ir, champions_list_r)
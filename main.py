@@ -1,6 +1,7 @@
 import loader
 from search import search
 import urllib.parse
+from operator import itemgetter
 import matplotlib.pyplot as plt
 
 file = 'IR_data_news_12k.json'
@@ -22,15 +23,15 @@ def find_most_used_tokens():
     for (token, _) in ir.pii:
         df_token.append((ir.get_document_frequency(token), token))
 
-    df_token = sorted(df_token, key=lambda x: x[0], reverse=True)
+    df_token = sorted(df_token, key=itemgetter(0), reverse=True)
     df_token = df_token[:50]
-    print(list(map(lambda x: x[1], df_token)))
+    print([token for (_, token) in df_token])
     for (df, token) in df_token:
         print(f"{token} : {df}")
 
     df_token = df_token[:10]
     df_values, tokens = zip(*df_token)
-    tokens = list(map(lambda t: t[::-1], tokens))
+    tokens = [t[::-1] for t in tokens]
     show_chart(tokens, df_values, 'Term', 'DF', 'Top 10 Tokens Distribution')
 
 
@@ -58,7 +59,7 @@ def search_for(query):
         print("------")
 
     docs, scores = zip(*search_result)
-    docs = list(map(lambda t: t.id, docs))
+    docs = [doc.id for doc in docs]
     show_chart(docs, scores, 'DocID', 'Score', f'Top 10 Pages for {query}')
 
 
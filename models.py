@@ -1,8 +1,10 @@
+from array import array
+from itertools import repeat
 from typing import Iterator
 from utils import *
+import numpy as np
 import score_weight
 import tokenizer
-import math
 
 
 class Document:
@@ -42,11 +44,11 @@ class Document:
         Returns:
             A list of tokens (strings) representing the document's content.
         """
-        return list(tokenizer.tokenize(self.content))
+        return next(tokenizer.tokenize_batch([self.content]))
 
-    def get_weighted_tokens(self):
+    def get_weighted_tokens(self) -> Iterator[tuple[str, float]]:
         """
-        Generates a list of tokens with weights based on their location in the document.
+        Generates the tokens with weights based on their location in the document.
 
         This method extracts tokens from the title and optionally tags (if provided).
         Each token is assigned a weight based on its location:
@@ -54,23 +56,35 @@ class Document:
             * Tag tokens receive a weight defined by `score_weight.TAG_TOKEN_WEIGHT`.
             * Content tokens receive a weight of 1 (no specific weight applied).
 
-        Returns:
-            A list of tuples where the first element is the token (string) and the second element
+        Titles and tags are short and repeat across documents, so they are tokenized
+        with the memoized `tokenizer.tokenize_cached`.
+
+        Yields:
+            Tuples where the first element is the token (string) and the second element
             is its weight (float).
         """
-        out = list(map(
-            lambda x: (x, score_weight.TITLE_TOKEN_WEIGHT),
-            tokenizer.tokenize(self.title)
-        ))
+        title_weight = score_weight.TITLE_TOKEN_WEIGHT
+        tag_weight = score_weight.TAG_TOKEN_WEIGHT
 
-        if self.tags is not None:
+        yield from zip(tokenizer.tokenize_cached(self.title), repeat(title_weight))
+        if self.tags:
             for tag in self.tags:
-                out += list(map(
-                    lambda x: (x, score_weight.TAG_TOKEN_WEIGHT),
-                    tokenizer.tokenize(tag)
-                ))
+                yield from zip(tokenizer.tokenize_cached(tag), repeat(tag_weight))
+
+
+def _doc_index_column(postings: list[tuple[int, "DocumentTokenData"]]) -> np.ndarray:
+    """
+    Builds the column of document indices of a posting list (sorted by document index).
 
-        return out
+    The indices are stored as 16-bit integers when the largest one fits, which halves the
+    memory read when scanning the column; otherwise they are stored as 32-bit integers.
+    """
+    dtype = np.uint16 if not postings or postings[-1][0] <= np.iinfo(np.uint16).max else np.int32
+    return np.fromiter(
+        (doc_id for (doc_id, _) in postings),
+        dtype=dtype,
+        count=len(postings),
+    )
 
 
 class DocumentTokenData:
@@ -79,15 +93,23 @@ class DocumentTokenData:
 
     This class stores data related to a token's occurrence in a single document, including:
         * Term Frequency (TF): The weighted frequency of the term within the document.
+        * TF-IDF (tf_idf): The TF multiplied by the term's IDF, set once the term is finalized.
         * Linear Term Frequency (linear_tf): The raw count of the term's occurrences in the document.
-        * Positions: A list of positions where the term appears within the document.
+        * Positions: An `array('i')` of positions where the term appears within the document's content.
+          (Occurrences in the title and tags are counted in linear_tf but have no position)
         * Weight: An internal weight used during TF calculation (defaults to 1).
+
+    There is an instance per (term, document) pair, so the attributes are declared in
+    `__slots__` to keep instances small.
     """
 
-    def __init__(self, tf=-1, linear_tf=0, positions: list[int] = None):
+    __slots__ = ('tf', 'tf_idf', 'linear_tf', 'positions', '_weight')
+
+    def __init__(self, tf=-1, linear_tf=0, positions: array = None):
         self.tf = tf
+        self.tf_idf = -1
         self.linear_tf = linear_tf
-        self.positions = list[int]() if positions is None else positions
+        self.positions = array('i') if positions is None else positions
         self._weight = 1
 
     def __add_position__(self, position: int, weight=1):
@@ -102,6 +124,24 @@ class DocumentTokenData:
         self.linear_tf += 1
         self._weight *= weight
 
+    def __add_positions__(self, positions: list[int]):
+        """
+        Adds several positions (in increasing order) where the term appears in the document's content.
+        """
+        self.positions.fromlist(positions)
+        self.linear_tf += len(positions)
+
+    def __add_count__(self, count: int, weight=1):
+        """
+        Adds `count` occurrences of the term that have no position (title and tags).
+
+        Args:
+            count: The number of occurrences.
+            weight: An optional weight to apply once per occurrence (defaults to 1).
+        """
+        self.linear_tf += count
+        self._weight *= weight ** count
+
     def __update_tf__(self):
         """
         Calculates the weighted Term Frequency (TF) for this token in the document.
@@ -124,28 +164,48 @@ class Token:
     """
     Represents a term (token) within the search system's vocabulary.
 
-    This class stores information about a term across all documents, including:
+    Documents are referred to by their index (their position in the list of indexed documents),
+    not by their string ID. This class stores information about a term across all documents, including:
         * Inverse Document Frequency (IDF): A score reflecting the term's rarity in the collection.
         * Linear Document Frequency (linear_df): The raw count of documents containing the term.
-        * Positional List: A dictionary mapping document IDs to `DocumentTokenData` objects
+        * Positional List: A dictionary mapping document indices to `DocumentTokenData` objects
           containing details about the term's occurrences in each document. (This can be
           replaced with a champions list for efficiency)
-        * Champions List: An optional list containing document IDs and corresponding
+        * Champions List: An optional list containing document indices and corresponding
           `DocumentTokenData` objects for the top documents (champions) where the term appears.
+        * Lookup dictionaries: The positional and champions lists are also kept as dictionaries
+          keyed by document index, so a single posting is found with one hash lookup.
+        * Columns: `doc_ids` and `tf_idfs`, the document indices (16-bit if they fit) and TF-IDF values of the
+          positional list stored as parallel NumPy arrays, so whole posting lists can be scanned vectorized.
+          (The champions list has columns of its own)
     """
 
+    __slots__ = (
+        'idf', 'linear_df', '__list__', 'list', 'champions_list',
+        '_by_id', '_champions_by_id', 'doc_ids', 'tf_idfs',
+        '_champion_doc_ids', '_champion_tf_idfs',
+    )
+
     def __init__(
             self,
             idf=-1,
             linear_df=0,
-            positional_list: list[tuple[str, DocumentTokenData]] = None,
-            champions_list: list[tuple[str, DocumentTokenData]] = None,
+            positional_list: list[tuple[int, DocumentTokenData]] = None,
+            champions_list: list[tuple[int, DocumentTokenData]] = None,
     ):
         self.idf = idf
         self.linear_df = linear_df
-        self.__list__ = dict[str, DocumentTokenData]() if positional_list is None else None
+        self.__list__ = dict[int, DocumentTokenData]() if positional_list is None else None
         self.list = positional_list
         self.champions_list = champions_list
+        self._by_id = None if positional_list is None else dict(positional_list)
+        self._champions_by_id = None if champions_list is None else dict(champions_list)
+        self.doc_ids = None
+        self.tf_idfs = None
+        self._champion_doc_ids = None
+        self._champion_tf_idfs = None
+        if positional_list is not None:
+            self.__update_columns__()
 
     def __add_position__(self, doc_id, position: int, weight=1):
         """
@@ -159,14 +219,82 @@ class Token:
 
         source.__add_position__(position, weight)
 
+    def __add_positions__(self, doc_id, positions: list[int]):
+        """
+        Adds several positions where the term appears in a specific document.
+        """
+        source = self.__list__.get(doc_id)
+        if source is None:
+            source = DocumentTokenData()
+            self.__list__[doc_id] = source
+            self.linear_df += 1
+
+        source.__add_positions__(positions)
+
+    def __add_count__(self, doc_id, count: int, weight=1):
+        """
+        Adds occurrences without a position of the term in a specific document.
+        """
+        source = self.__list__.get(doc_id)
+        if source is None:
+            source = DocumentTokenData()
+            self.__list__[doc_id] = source
+            self.linear_df += 1
+
+        source.__add_count__(count, weight)
+
+    def __merge__(self, other):
+        """
+        Merges the postings of another (not finalized) token for a disjoint set of documents.
+        """
+        self.__list__.update(other.__list__)
+        self.linear_df += other.linear_df
+
     def __finalize__(self, number_of_documents):
         self.idf = score_weight.calculate_idf(self.linear_df, number_of_documents)
         for token_data in self.__list__.values():
             token_data.__update_tf__()
 
-        self.list = sorted(
-            self.__list__.items(),
-            key=lambda x: x[0]
+        # Documents are indexed in increasing index order, so the postings are already sorted
+        self.list = list(self.__list__.items())
+        self.__update_columns__()
+
+        # The dictionary built while indexing becomes the lookup dictionary
+        self._by_id = self.__list__
+        self.__list__ = None
+
+    def __set_champions_list__(self, champions_list: list[tuple[int, DocumentTokenData]]):
+        """
+        Sets the champions list, which then becomes the scope of search operations.
+        """
+        self.champions_list = champions_list
+        if champions_list is self.list:
+            self._champions_by_id = self._by_id
+            self._champion_doc_ids = self.doc_ids
+            self._champion_tf_idfs = self.tf_idfs
+        else:
+            self._champions_by_id = dict(champions_list)
+            self._champion_doc_ids = _doc_index_column(champions_list)
+            self._champion_tf_idfs = np.fromiter(
+                (doc_data.tf_idf for (_, doc_data) in champions_list),
+                dtype=np.float32,
+                count=len(champions_list),
+            )
+
+    def __update_columns__(self):
+        """
+        Computes the TF-IDF of each posting and rebuilds the columns (`doc_ids`, `tf_idfs`)
+        from the positional list.
+        """
+        idf = self.idf
+        for (_, doc_data) in self.list:
+            doc_data.tf_idf = doc_data.tf * idf
+
+        self.doc_ids = _doc_index_column(self.list)
+        self.tf_idfs = np.fromiter(
+            (doc_data.tf_idf for (_, doc_data) in self.list),
+            dtype=np.float32,
+            count=len(self.list),
         )
 
     def __get_search_scope_list__(self):
@@ -178,9 +306,19 @@ class Token:
         """
         return self.champions_list if self.champions_list is not None else self.list
 
+    def __get_search_scope_columns__(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the columns (document indices and TF-IDF values) of the list to use for search operations.
+
+        Like `__get_search_scope_list__`, this prioritizes the champions list if it exists.
+        """
+        if self.champions_list is not None:
+            return self._champion_doc_ids, self._champion_tf_idfs
+        return self.doc_ids, self.tf_idfs
+
     def get_term_frequency(self, doc_id):
         """
-        Retrieves the linear term frequency (TF) for a specific document.
+        Retrieves the linear term frequency (TF) for a specific document (by index).
 
         This method attempts to get the `DocumentTokenData` object for the given document ID
         and returns its linear TF value, or 0 if the document doesn't contain the term.
@@ -194,12 +332,14 @@ class Token:
         """
         Provides access to the `DocumentTokenData` object for a specific document ID.
 
-        This method utilizes a binary search implemented in `binary_search_tuple` to
-        efficiently find the document's data within the sorted list of document IDs.
+        This method looks the document up in the dictionary of the search scope list
+        (champions or positional), raising `KeyError` if the document doesn't contain the term.
         """
-        return binary_search_tuple(self.__get_search_scope_list__(), doc_id)
+        if self.champions_list is not None:
+            return self._champions_by_id[doc_id]
+        return self._by_id[doc_id]
 
-    def __iter__(self, *args, **kwargs) -> Iterator[tuple[str, DocumentTokenData]]:
+    def __iter__(self, *args, **kwargs) -> Iterator[tuple[int, DocumentTokenData]]:
         """
          Allows iterating over the documents containing the term.
 
@@ -221,6 +361,7 @@ class PositionalInvertedIndexOnMemory:
     def __init__(self, tokens: list[tuple[str, Token]] = None):
         self.__tokens__ = dict[str, Token]() if tokens is None else None
         self.tokens = tokens
+        self._by_term = None if tokens is None else dict(tokens)
 
     def __add_token__(self, token_str, doc_id, position, weight=1):
         """
@@ -233,17 +374,61 @@ class PositionalInvertedIndexOnMemory:
 
         source.__add_position__(doc_id, position, weight)
 
-    def __finalize__(self, number_of_documents):
+    def __add_positions__(self, token_str, doc_id, positions: list[int]):
+        """
+        Adds all content positions of a term in a document to the index at once.
+        """
+        source = self.__tokens__.get(token_str)
+        if source is None:
+            source = Token()
+            self.__tokens__[token_str] = source
+
+        source.__add_positions__(doc_id, positions)
+
+    def __add_token_bulk__(self, token_str, doc_id, count, weight=1):
+        """
+        Adds `count` occurrences without a position (title and tags) of a term to the index.
+        """
+        source = self.__tokens__.get(token_str)
+        if source is None:
+            source = Token()
+            self.__tokens__[token_str] = source
+
+        source.__add_count__(doc_id, count, weight)
+
+    def __merge__(self, other):
+        """
+        Merges another (not finalized) index, built from a disjoint set of documents, into this one.
+        """
+        for token_str, token in other.__tokens__.items():
+            source = self.__tokens__.get(token_str)
+            if source is None:
+                self.__tokens__[token_str] = token
+            else:
+                source.__merge__(token)
+
+    def __finalize__(self, number_of_documents, max_document_frequency_ratio=None):
         """
         Finalizes the in-memory index by calculating IDF and TF values for each term.
+
+        If `max_document_frequency_ratio` is given, terms that appear in a larger ratio of the
+        documents are eliminated from the index first. Such terms have an IDF close to zero, so
+        they hardly affect scores while having the longest posting lists.
         """
-        for token in self.__tokens__.values():
+        tokens = self.__tokens__
+        if max_document_frequency_ratio is not None:
+            max_df = max_document_frequency_ratio * number_of_documents
+            tokens = {t: token for (t, token) in tokens.items() if token.linear_df <= max_df}
+
+        for token in tokens.values():
             token.__finalize__(number_of_documents)
 
-        self.tokens = sorted(
-            self.__tokens__.items(),
-            key=lambda x: x[0],
-        )
+        # Terms are unique, so the tuples are ordered by term without a key function
+        self.tokens = sorted(tokens.items())
+
+        # The dictionary built while indexing becomes the lookup dictionary
+        self._by_term = tokens
+        self.__tokens__ = None
 
     def __iter__(self, *args, **kwargs) -> Iterator[tuple[str, Token]]:
         """
@@ -257,10 +442,10 @@ class PositionalInvertedIndexOnMemory:
         """
         Provides access to a specific term (token) by string.
 
-        This method utilizes a binary search implemented in `binary_search_tuple`
-        to efficiently find the token object within the sorted list of tokens.
+        This method looks the term up in a dictionary of the vocabulary,
+        raising `KeyError` if the term is not in the vocabulary.
         """
-        return binary_search_tuple(self.tokens, token)
+        return self._by_term[token]
 
 
 class IRData:
@@ -268,7 +453,12 @@ class IRData:
     Holds all data structures required for full-text search operations.
 
     This class combines a positional inverted index, a list of documents, and additional metadata
-    like document lengths and date range.
+    like document lengths and date range. Documents are stored in the order they were indexed, so
+    the document indices used in the index address `docs` and the `doc_lengths`, `doc_timestamps`
+    and `doc_recencies` NumPy arrays.
+
+    The content and tags of the given documents are dropped in place, as search only needs their
+    metadata; so the documents must be indexed before they are passed to this class.
     """
 
     def __init__(
@@ -278,38 +468,60 @@ class IRData:
     ):
         self.pii = pii
 
-        self.docs = dict[str, Document]()
-        self.max_doc_date = datetime.min
-        self.min_doc_date = datetime.max
-
-        for d in docs:
-            # Update document metadata (max/min date)
-            self.max_doc_date = max(parse_date(d.date, self.max_doc_date), self.max_doc_date)
-            self.min_doc_date = min(parse_date(d.date, self.min_doc_date), self.min_doc_date)
-
-            # Store document object with minimal content (for space efficiency)
-            self.docs[d.id] = Document(
-                doc_id=d.id,
-                title=d.title,
-                url=d.url,
-                content="",
-                date=d.date,
-                tags=None
+        # Bumped whenever the index is changed in place (e.g. champions lists), so memoized searches are not reused
+        self.version = 0
+
+        self.docs = list(docs)
+        dates = []
+
+        for d in self.docs:
+            dates.append(parse_date(d.date, None))
+
+            # Keep the document object with minimal content (for space efficiency)
+            d.content = ""
+            d.tags = None
+
+        # Document metadata (max/min date)
+        valid_dates = [date for date in dates if date is not None]
+        self.max_doc_date = max(valid_dates, default=datetime.min)
+        self.min_doc_date = min(valid_dates, default=datetime.max)
+
+        # Precompute the dates of documents as epoch seconds (the earliest date if invalid), and their recency
+        # for date scores: the position of the date in the range, from 0 (earliest) to 1 (latest), as in
+        # `score_weight.date_score` without the weight (all 0 if no document has a valid date)
+        self.doc_timestamps = np.zeros(len(self.docs), dtype=np.int64)
+        self.doc_recencies = np.zeros(len(self.docs))
+        if valid_dates:
+            min_timestamp = int(self.min_doc_date.timestamp())
+            self.doc_timestamps = np.array(
+                [min_timestamp if date is None else int(date.timestamp()) for date in dates],
+                dtype=np.int64,
             )
+            total_delta = max(1.0, self.max_doc_date.timestamp() - min_timestamp)
+            self.doc_recencies = np.abs((self.doc_timestamps - min_timestamp) / total_delta)
 
-        # Precompute document lengths for scoring
-        doc_lengths = {}
+        # Maps document IDs to their index, for lookups by ID
+        self.doc_index = {d.id: i for (i, d) in enumerate(self.docs)}
+
+        # Precompute document lengths for scoring, in a single vectorized pass over all postings
+        doc_indices = []
+        tf_idf = []
         for (_, token) in pii.tokens:
-            for (doc_id, doc_data) in token.list:
-                tf_idf = doc_data.tf * token.idf
-                if doc_id in doc_lengths:
-                    doc_lengths[doc_id] += tf_idf ** 2
-                else:
-                    doc_lengths[doc_id] = tf_idf ** 2
+            doc_indices.append(token.doc_ids)
+            tf_idf.append(token.tf_idfs)
+
+        doc_lengths = np.zeros(len(self.docs))
+        if doc_indices:
+            doc_lengths = np.bincount(
+                np.concatenate(doc_indices),
+                weights=np.square(np.concatenate(tf_idf), dtype=np.float64),
+                minlength=len(self.docs),
+            )
+        self.doc_lengths = np.maximum(1.0, np.sqrt(doc_lengths))
 
-        for doc in doc_lengths.keys():
-            doc_lengths[doc] = max(1.0, math.sqrt(doc_lengths[doc]))
-        self.doc_lengths = doc_lengths
+        # Scratch buffers of searches, reset after each query instead of allocated for it (not thread-safe)
+        self._scores_buffer = np.zeros(len(self.docs), dtype=np.float32)
+        self._matched_buffer = np.zeros(len(self.docs), dtype=bool)
 
     def get_document_frequency(self, token_str):
         """
@@ -331,9 +543,9 @@ class IRData:
         This method attempts to get the `Token` object for the given term string from the index
         and then uses it to retrieve the `DocumentTokenData` object for the specified document ID.
         If successful, it returns the TF value from `DocumentTokenData`, or 0 if the document
-        doesn't contain the term.
+        doesn't contain the term (or doesn't exist).
         """
         try:
-            return self.pii[token_str].get_term_frequency(doc_id)
+            return self.pii[token_str].get_term_frequency(self.doc_index[doc_id])
         except KeyError:
             return 0
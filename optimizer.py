@@ -1,48 +1,53 @@
-import json
+import mmap
+import pickle
+
 from models import *
+from utils import top_k_positions
+import score_weight
+
+# Bumped whenever the layout of the cache file changes, so stale caches are rebuilt
+_CACHE_VERSION = 5
 
 
 def write_cache(
         pii: PositionalInvertedIndexOnMemory,
         file: str,
+        docs: list[Document],
 ):
     """
-    Writes the contents of a Positional Inverted Index (PII) stored in memory to a cache file in JSON format.
+    Writes the contents of a Positional Inverted Index (PII) stored in memory to a binary cache file.
 
     Args:
         pii (PositionalInvertedIndexOnMemory): An object representing the positional inverted index stored in memory.
         file (str): The base name of the file to which the cache will be written. The function appends ".cache" to this name.
+        docs (list[Document]): The indexed documents, in the order they were indexed.
 
     Cache Structure:
-        The cache file is a JSON array of tokens, where each token is represented by a dictionary with the following keys:
-            - "term": The string representation of the token.
-            - "idf": The inverse document frequency of the token.
-            - "df": The linear document frequency of the token.
-            - "list": A list of dictionaries, each representing a document in which the token appears.
-            Each dictionary contains:
-                - "doc_id": The document ID where the token is found.
-                - "tf": The term frequency of the token in the document.
-                - "lf": The linear term frequency of the token in the document.
-                - "list": A list of positions (integers) where the token appears in the document.
+        The cache file is a pickled `(version, max_df_ratio, doc_ids, tokens)` tuple. `max_df_ratio` is the
+        `score_weight.MAX_DOCUMENT_FREQUENCY_RATIO` the index was created with, as it decides which terms are
+        in the index. `doc_ids` is the list of the IDs of the indexed documents in order, as postings refer
+        to documents by their index in it.
+        `tokens` is a list of tuples, one per token, laid out positionally (no key strings are stored):
+            - term: The string representation of the token.
+            - idf: The inverse document frequency of the token.
+            - df: The linear document frequency of the token.
+            - list: A list of tuples, each representing a document in which the token appears.
+            Each tuple contains:
+                - doc_id: The index of the document where the token is found.
+                - tf: The term frequency of the token in the document.
+                - lf: The linear term frequency of the token in the document.
+                - list: An `array('i')` of positions where the token appears in the document.
 
     Example Cache File Structure:
-    [
-        {
-            "term": "example",
-            "idf": 1.5,
-            "df": 10,
-            "list": [
-                {
-                    "doc_id": 1,
-                    "tf": 3,
-                    "lf": 1.2,
-                    "list": [5, 15, 20]
-                },
-                ...
-            ]
-        },
-        ...
-    ]
+    (
+        5,
+        None,
+        ["706", "2653", ...],
+        [
+            ("example", 1.5, 10, [(0, 3.0, 4, array('i', [5, 15, 20, 31])), ...]),
+            ...
+        ]
+    )
     """
 
     postings_list = []
@@ -50,60 +55,60 @@ def write_cache(
         positional_list = []
         for (doc_id, doc_data) in token.list:
             positional_list.append(
-                {
-                    "doc_id": doc_id,
-                    "tf": doc_data.tf,
-                    "lf": doc_data.linear_tf,
-                    "list": doc_data.positions
-                }
+                (doc_id, doc_data.tf, doc_data.linear_tf, doc_data.positions)
             )
 
-        token_data = {
-            "term": token_str,
-            "idf": token.idf,
-            "df": token.linear_df,
-            "list": positional_list,
-        }
-        postings_list.append(token_data)
+        postings_list.append((token_str, token.idf, token.linear_df, positional_list))
 
-    with open(file + ".cache", 'w', encoding='utf-8') as f:
-        json.dump(postings_list, f, ensure_ascii=False)
+    with open(file + ".cache", 'wb') as f:
+        pickle.dump(
+            (_CACHE_VERSION, score_weight.MAX_DOCUMENT_FREQUENCY_RATIO, [d.id for d in docs], postings_list),
+            f,
+            protocol=5,
+        )
 
 
-def read_from_cache(file: str):
+def read_from_cache(file: str, docs: list[Document]):
     """
-    Reads a positional inverted index from a JSON cache file.
+    Reads a positional inverted index from a binary cache file.
+
+    The file is memory-mapped and unpickled in place, so it is not copied into a bytes object
+    first and the OS can page it in sequentially.
 
     Args:
         file (str): The base filename for the cache file. The ".cache" extension will be appended.
+        docs (list[Document]): The loaded documents, which the cached index must have been created from
+            (the same documents in the same order).
 
     Returns:
         PositionalInvertedIndexOnMemory: The loaded positional inverted index.
-            Or None if the cache file is not found.
+            Or None if the cache file is not found, was written in an outdated format,
+            or was created from other documents or with another `score_weight.MAX_DOCUMENT_FREQUENCY_RATIO`.
     """
     try:
-        with open(file + ".cache", 'r', encoding='utf-8') as f:
-            json_data = json.load(f)
+        with open(file + ".cache", 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            version, max_df_ratio, doc_ids, postings_list = pickle.loads(mm)
     except FileNotFoundError:
         return None
+    except (pickle.UnpicklingError, EOFError, ValueError, TypeError):
+        # Not a cache written by this version of `write_cache`
+        return None
+
+    if version != _CACHE_VERSION or max_df_ratio != score_weight.MAX_DOCUMENT_FREQUENCY_RATIO:
+        return None
+
+    # Postings refer to documents by index, so they are only valid for the same documents in the same order
+    if len(doc_ids) != len(docs) or any(doc_id != d.id for (doc_id, d) in zip(doc_ids, docs)):
+        return None
 
     tokens = list[tuple[str, Token]]()
-    for json_token in json_data:
-        positional_list = list[tuple[str, DocumentTokenData]]()
-        for json_list in json_token["list"]:
-            doc_data = DocumentTokenData(
-                tf=json_list["tf"],
-                linear_tf=json_list["lf"],
-                positions=json_list["list"],
-            )
-            positional_list.append(tuple((json_list["doc_id"], doc_data)))
+    for (term, idf, df, posting_list) in postings_list:
+        positional_list = list[tuple[int, DocumentTokenData]]()
+        for (doc_id, tf, linear_tf, positions) in posting_list:
+            positional_list.append((doc_id, DocumentTokenData(tf, linear_tf, positions)))
 
-        token = Token(
-            idf=json_token["idf"],
-            linear_df=json_token["df"],
-            positional_list=positional_list,
-        )
-        tokens.append(tuple((json_token["term"], token)))
+        tokens.append((term, Token(idf, df, positional_list)))
 
     return PositionalInvertedIndexOnMemory(tokens)
 
@@ -114,19 +119,25 @@ def generate_champions_list(ir: IRData, r):
 
     This function iterates through each token in the IRData object's positional inverted index
     and creates a champions list containing the top 'r' documents for each term based on a TF-IDF score.
+    Scores are computed on the token's columns at once, and the top 'r' are selected with
+    `utils.top_k_positions` in linear time instead of sorting the whole positional list.
 
     Args:
         ir (IRData): The IRData object containing the inverted index and document data.
         r (int): The number of top documents to include in the champions list.
-            If None, no champions lists are generated.
+            If None, no champions lists are generated (and if not positive, the lists are empty).
     """
     if r is None:
         return
 
-    for (_, token) in ir.pii:
-        def tf_idf_func(td):
-            return token.idf * td[1].tf / ir.doc_lengths[td[0]]
+    ir.version += 1
 
-        tf_sorted = sorted(token.list, key=tf_idf_func, reverse=True)
-        tf_sorted = tf_sorted[:r]
-        token.champions_list = sorted(tf_sorted, key=lambda x: x[0])
+    for (_, token) in ir.pii:
+        if 0 < len(token.list) <= r:
+            token.__set_champions_list__(token.list)
+            continue
+
+        scores = token.tf_idfs / ir.doc_lengths[token.doc_ids]
+        # Ties on the r-th score are kept in posting order
+        top = top_k_positions(scores, r)
+        token.__set_champions_list__([token.list[i] for i in top.tolist()])
@@ -8,9 +8,16 @@ TITLE_TOKEN_WEIGHT = 2  # Weight for tokens found in document title
 TAG_TOKEN_WEIGHT = 1.5  # Weight for tokens found in document tags
 DATE_WEIGHT = 0.4  # Weight for document recency (newer gets a boost)
 
-# Optional threshold for eliminating terms from the search index if they appear too frequently
+# Optional minimum TF-IDF of a posting to be scored; postings with a lower weight are skipped by searches
 INDEX_ELIMINATION = None
 
+# Optional maximum ratio of documents a term may appear in (e.g. 0.5); more frequent terms are
+# dropped from the index when it is created (a cached index created with another ratio is rebuilt)
+MAX_DOCUMENT_FREQUENCY_RATIO = None
+
+# Precomputed TF values for the (far most common) small linear term frequencies
+_TF_TABLE = tuple(0 if i == 0 else 1 + math.log2(i) for i in range(256))
+
 
 def calculate_tf(linear_tf):
     """
@@ -18,6 +25,7 @@ def calculate_tf(linear_tf):
 
     TF reflects how often a term appears in the document. This function uses a logarithmic scale
     (base 2) to reward frequent terms but avoid giving excessive weight to very frequent ones.
+    Values for linear counts below 256 are looked up in a precomputed table.
 
     Args:
         linear_tf: The number of times the term appears in the document (linear count).
@@ -25,7 +33,7 @@ def calculate_tf(linear_tf):
     Returns:
         The calculated TF value.
     """
-    return 0 if linear_tf == 0 else \
+    return _TF_TABLE[linear_tf] if linear_tf < 256 else \
         1 + math.log2(linear_tf)
 
 
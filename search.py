@@ -1,86 +1,113 @@
+from collections import OrderedDict
+from functools import lru_cache
 from typing import Iterable
+from weakref import WeakKeyDictionary
 
 import score_weight
 from models import IRData, PositionalInvertedIndexOnMemory, Document
 from loader import create_query_pii
-import heapq
-
-
-class __SearchedDocument:
-    """
-    Representing a document with an associated score for comparison in heap
-    """
-
-    def __init__(self, doc, score):
-        self.doc = doc
-        self.score = score
-
-    def __lt__(self, other):
-        return self.score < other.score
-
-    def __le__(self, other):
-        return self.score <= other.score
-
-    def __gt__(self, other):
-        return self.score > other.score
-
-    def __ge__(self, other):
-        return self.score >= other.score
+from utils import top_k_positions
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+if njit is not None:
+    @njit(cache=True, fastmath=True)
+    def _accumulate(doc_ids, tf_idfs, wtq, scores, matched):
+        for i in range(doc_ids.size):
+            scores[doc_ids[i]] += tf_idfs[i] * wtq
+            matched[doc_ids[i]] = True
+
+    # Compile (or load the compiled kernels from numba's cache) at import rather than on the first query,
+    # for both types of document index columns
+    for _dtype in (np.uint16, np.int32):
+        _accumulate(
+            np.zeros(1, dtype=_dtype),
+            np.zeros(1, dtype=np.float32),
+            np.float32(1),
+            np.zeros(1, dtype=np.float32),
+            np.zeros(1, dtype=bool),
+        )
+else:
+    def _accumulate(doc_ids, tf_idfs, wtq, scores, matched):
+        # A document appears once in a posting list, so the fancy-indexed update is not buffered away
+        scores[doc_ids] += tf_idfs * wtq
+        matched[doc_ids] = True
 
 
 def cosine_score(
-        pii: PositionalInvertedIndexOnMemory,
+        ir: IRData,
         query_pii: PositionalInvertedIndexOnMemory,
-):
+) -> tuple[np.ndarray, np.ndarray]:
     """
     Calculate cosine similarity scores between documents and a query based on their
     positional inverted index representations.
 
+    The scores are accumulated in the dense scratch buffers of `ir` (indexed by document index), adding the TF-IDF
+    column of each query term's postings at once instead of posting by posting. Postings with a
+    TF-IDF below `score_weight.INDEX_ELIMINATION` (if set) are eliminated. If numba is
+    installed, the accumulation is a compiled loop; otherwise it is done with NumPy indexing.
+
     Args:
-        pii (PositionalInvertedIndexOnMemory): Positional inverted index of documents.
+        ir (IRData): Information Retrieval data containing the positional inverted index of documents.
         query_pii (PositionalInvertedIndexOnMemory): Positional inverted index of the query.
 
     Returns:
-        dict: A dictionary where keys are document IDs and values are their respective scores.
+        tuple[np.ndarray, np.ndarray]: The indices of the documents containing any of the query terms
+        (in increasing order) and their respective scores (not normalized).
     """
-    doc_scores = {}
+    scores = ir._scores_buffer
+    matched = ir._matched_buffer
+    threshold = score_weight.INDEX_ELIMINATION
 
-    for (token, query_token_data) in query_pii:
-        wtq = query_token_data.list[0][1].tf
-        try:
-            token_data = pii[token]
-        except KeyError:
-            continue
+    try:
+        for (token, query_token_data) in query_pii:
+            wtq = query_token_data.list[0][1].tf
+            try:
+                token_data = ir.pii[token]
+            except KeyError:
+                continue
 
-        for (doc_id, doc_data) in token_data:
-            wtd = doc_data.tf * token_data.idf
-            if doc_id in doc_scores:
-                doc_scores[doc_id] += wtd * wtq
-            else:
-                doc_scores[doc_id] = wtd * wtq
+            doc_ids, tf_idfs = token_data.__get_search_scope_columns__()
+            if threshold is not None:
+                # Postings are ordered by document, not by weight, so all of the low-weight ones are masked out
+                kept = tf_idfs >= threshold
+                doc_ids = doc_ids[kept]
+                tf_idfs = tf_idfs[kept]
 
-            if score_weight.INDEX_ELIMINATION is not None and \
-                    wtd < score_weight.INDEX_ELIMINATION:
-                break
+            _accumulate(doc_ids, tf_idfs, np.float32(wtq), scores, matched)
+    finally:
+        # Only the matched entries are set, so resetting them clears the buffers for the next query
+        doc_ids = np.flatnonzero(matched)
+        doc_scores = scores[doc_ids]
+        scores[doc_ids] = 0
+        matched[doc_ids] = False
 
-    return doc_scores
+    return doc_ids, doc_scores
 
 
 def phrase_query(
         pii: PositionalInvertedIndexOnMemory,
         query_pii: PositionalInvertedIndexOnMemory,
-        doc_ids: Iterable[str],
+        doc_ids: Iterable[int],
 ):
     """
     Perform phrase queries to find consecutive matches in documents.
 
+    The positions of the following query terms in each document are collected into sets first,
+    so checking whether a match continues is a constant time lookup.
+
     Args:
         pii (PositionalInvertedIndexOnMemory): Positional inverted index of documents.
         query_pii (PositionalInvertedIndexOnMemory): Positional inverted index of the query.
-        doc_ids (Iterable[str]): Iterable of document IDs to search within.
+        doc_ids (Iterable[int]): Iterable of document indices to search within.
 
     Returns:
-        dict: A dictionary where keys are document IDs and values are their respective phrase scores.
+        dict: A dictionary where keys are document indices and values are their respective phrase scores.
     """
     len_of_query = len(query_pii.tokens)
     doc_scores = {}
@@ -99,26 +126,29 @@ def phrase_query(
         if positions is None or token_pos + 1 >= len_of_query:
             continue
 
-        for start_pos in positions:
-            if start_pos == -1:
-                continue
-
-            pos = start_pos
-            match_length = 1
+        # Sets of the positions of the following terms, up to the first one missing in the document
+        following_positions = []
+        for token, _ in query_pii.tokens[token_pos + 1:]:
+            try:
+                following_positions.append(set(pii[token][doc_id].positions))
+            except KeyError:
+                break
 
-            for token, _ in query_pii.tokens[token_pos + 1:]:
-                try:
-                    sp = pii[token][doc_id].positions
-                except KeyError:
-                    break
+        if not following_positions:
+            continue
 
-                pos += 1
-                if pos in sp:
+        longest_match = len(following_positions) + 1
+        for pos in positions:
+            match_length = 1
+            for sp in following_positions:
+                if pos + match_length in sp:
                     match_length += 1
                 else:
                     break
 
             max_consecutive = max(max_consecutive, match_length)
+            if max_consecutive == longest_match:
+                break
 
         if max_consecutive > 1:
             doc_scores[doc_id] = 1 + score_weight.PHRASE_QUERY_WEIGHT * \
@@ -127,6 +157,54 @@ def phrase_query(
     return doc_scores
 
 
+@lru_cache(maxsize=4096)
+def _cached_query_pii(query: str) -> PositionalInvertedIndexOnMemory:
+    """
+    Creates the positional inverted index of a query (see `create_query_pii`) and memoizes it by query.
+
+    The returned index is shared by the searches of the query, so it must be treated as read-only.
+    """
+    return create_query_pii(query)
+
+
+# The number of memoized search results per IRData object
+_SEARCH_CACHE_SIZE = 1024
+
+# Memoized search results (an LRU ordered dictionary) of each IRData object, which is not kept alive by it
+_search_caches = WeakKeyDictionary[IRData, OrderedDict]()
+
+
+def _search(
+        ir: IRData,
+        query: str,
+        k: int,
+        date_score: bool,
+        phrase_query_score: bool,
+        score_function,
+) -> tuple[tuple[Document, float], ...]:
+    """
+    Performs the search of `search`, without memoizing it.
+    """
+    query_pii = _cached_query_pii(query)
+
+    doc_ids, doc_scores = score_function(ir, query_pii)
+    final_scores = doc_scores / ir.doc_lengths[doc_ids]
+    doc_indices = doc_ids.tolist()
+    if phrase_query_score:
+        phrase_scores = phrase_query(ir.pii, query_pii, doc_indices)
+        if phrase_scores:
+            # The matched document indices are sorted, so the phrase matches are located by bisection
+            positions = np.searchsorted(doc_ids, np.fromiter(phrase_scores.keys(), dtype=np.intp))
+            final_scores[positions] *= np.fromiter(phrase_scores.values(), dtype=np.float64)
+
+    if date_score:
+        final_scores += score_weight.DATE_WEIGHT * ir.doc_recencies[doc_ids]
+
+    top = top_k_positions(final_scores, k)
+    top = top[np.argsort(-final_scores[top], kind='stable')]
+    return tuple(zip([ir.docs[doc_indices[i]] for i in top.tolist()], final_scores[top].tolist()))
+
+
 def search(
         ir: IRData,
         query: str,
@@ -138,37 +216,51 @@ def search(
     """
     Perform a document search using a given Information Retrieval (IR) data structure and query.
 
+    The results of the last 1024 searches on each IRData object are memoized, so repeated queries
+    are answered without scoring again. They are keyed by the query, the options, the version of `ir`
+    (bumped when its champions lists are generated) and the `score_weight` weights used by searches,
+    so changing any of these never returns stale results. The memoized results are released along
+    with `ir`. The indexes of the last 4096 query strings are memoized too, so a query is not
+    tokenized again for other options or another IRData object.
+
     Args:
         ir (IRData): Information Retrieval data containing documents and indices.
         query (str): The query string to search for.
         k (int, optional): The number of top results to return. Defaults to 10.
         date_score (bool, optional): Whether to consider date-based scoring. Defaults to True.
         phrase_query_score (bool, optional): Whether to include phrase query scoring. Defaults to True.
-        score_function (function, optional): The scoring function to use. Defaults to cosine_score.
+        score_function (function, optional): The scoring function to use, called with `ir` and the query's
+            positional inverted index and returning the matched document indices and their scores
+            (like `cosine_score`). Defaults to cosine_score.
 
     Returns:
         list[tuple[Document, float]]: A list of tuples where each tuple contains a Document object
         and its corresponding relevance score.
     """
-    query_pii = create_query_pii(query)
-
-    doc_scores = score_function(ir.pii, query_pii)
-    phrase_scores = None
-    if phrase_query_score:
-        phrase_scores = phrase_query(ir.pii, query_pii, doc_scores.keys())
-    doc_heap = []
-
-    for doc_id, score_value in doc_scores.items():
-        doc = ir.docs[doc_id]
-        normalized_score = score_value / ir.doc_lengths[doc_id]
-        if phrase_scores is not None:
-            normalized_score *= phrase_scores.get(doc_id, 1)
-
-        if date_score:
-            normalized_score += score_weight.date_score(doc.date, ir.max_doc_date, ir.min_doc_date)
-        heapq.heappush(doc_heap, __SearchedDocument(doc, normalized_score))
-
-    return list(map(
-        lambda sd: (sd.doc, sd.score),
-        heapq.nlargest(k, doc_heap, key=lambda sd: sd.score)
-    ))
+    key = (
+        query, k, date_score, phrase_query_score, score_function, ir.version,
+        score_weight.INDEX_ELIMINATION, score_weight.DATE_WEIGHT, score_weight.PHRASE_QUERY_WEIGHT,
+    )
+    cache = _search_caches.get(ir)
+    if cache is None:
+        cache = OrderedDict()
+        _search_caches[ir] = cache
+
+    results = cache.get(key)
+    if results is None:
+        results = _search(ir, query, k, date_score, phrase_query_score, score_function)
+        cache[key] = results
+        if len(cache) > _SEARCH_CACHE_SIZE:
+            cache.popitem(last=False)
+    else:
+        cache.move_to_end(key)
+
+    return list(results)
+
+
+def clear_search_cache():
+    """
+    Clears the memoized results of `search` (of every IRData object), and the memoized query indexes.
+    """
+    _search_caches.clear()
+    _cached_query_pii.cache_clear()
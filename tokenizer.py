@@ -1,12 +1,17 @@
-from typing import Iterator
+from functools import lru_cache
+from typing import Iterable, Iterator
 
 import hazm
 import emoji
 
 _normalizer = hazm.Normalizer()
+_word_tokenizer = hazm.WordTokenizer()
 _lemmatizer = hazm.Lemmatizer()
 
-_stopwords = hazm.stopwords_list()
+# Tokens follow a Zipfian distribution, so the per-token steps are memoized with this many entries each
+_TOKEN_CACHE_SIZE = 200_000
+
+_stopwords = frozenset(hazm.stopwords_list())
 _punctuations = [')', '(', '>', '<', "؛",
                  "،", '{', '}', "؟", ':',
                  "–", '»', '"', '«', '[',
@@ -21,74 +26,110 @@ _numbers = [
     '0', '1', '2', '3', '4', '5', '6', '7', '8', '9',  # Latin
 ]
 
+# Every character that is a part of an emoji, including the variation selectors and the joiner
+_emoji_characters = frozenset(''.join(emoji.EMOJI_DATA)) | {'\ufe0e', '\ufe0f', '\u200d'}
+
+# Translation tables deleting the characters above, built once for str.translate
+_punctuations_table = str.maketrans('', '', ''.join(_punctuations))
+_numbers_table = str.maketrans('', '', ''.join(_numbers))
+_punctuations_and_numbers_table = str.maketrans('', '', ''.join(_punctuations + _numbers))
 
-def _filter_stopwords(token: str):
+
+def _strip_punctuations(token):
     """
-    Check if a token is a stopword.
+    Remove punctuation characters from a token.
 
     Args:
-        token (str): The token to check.
+        token (str): The token to process.
 
     Returns:
-        bool: True if the token is not a stopword, False otherwise.
+        str: The token without punctuation characters.
     """
-    return token not in _stopwords
+    return token.translate(_punctuations_table)
 
 
-def _translate(token, filter_list):
+def _strip_numbers(token):
     """
-    Translate characters in the token based on a filter list.
+    Remove numeric characters from a token.
 
     Args:
-        token (str): The token to translate.
-        filter_list (list): A list of characters to remove from the token.
+        token (str): The token to process.
 
     Returns:
-        str: The translated token with specified characters removed.
+        str: The token without numeric characters.
     """
-    d = {ord(c): None for c in filter_list}
-    return token.translate(d)
+    return token.translate(_numbers_table)
 
 
-def _strip_punctuations(token):
+def _strip_emoji(text):
     """
-    Remove punctuation characters from a token.
+    Remove emoji characters from a text.
+
+    Texts without any character of an emoji (nearly all of them) are returned as they are,
+    without going through `emoji.replace_emoji`.
 
     Args:
-        token (str): The token to process.
+        text (str): The text to process.
 
     Returns:
-        str: The token without punctuation characters.
+        str: The text without emoji characters.
     """
-    return _translate(token, _punctuations)
+    if _emoji_characters.isdisjoint(text):
+        return text
+    return emoji.replace_emoji(text)
 
 
-def _strip_numbers(token):
+def _strip_punctuations_and_numbers(token):
     """
-    Remove numeric characters from a token.
+    Remove punctuation and numeric characters from a token, with a single translation table.
 
     Args:
         token (str): The token to process.
 
     Returns:
-        str: The token without numeric characters.
+        str: The token without punctuation and numeric characters.
     """
-    return _translate(token, _numbers)
+    return token.translate(_punctuations_and_numbers_table)
 
 
-def _strip_emoji(text):
+@lru_cache(maxsize=None)
+def _get_strip_function(strip_punctuations, strip_emoji, strip_numbers):
     """
-    Remove emoji characters from a text.
+    Get a memoized function removing the selected characters from a token, in a single step per token.
+
+    The characters are removed in the order punctuations, emoji, numbers. Punctuations and numbers
+    are removed in one pass when emojis are not stripped in between.
 
     Args:
-        text (str): The text to process.
+        strip_punctuations (bool): Whether to remove punctuation characters.
+        strip_emoji (bool): Whether to remove emoji characters.
+        strip_numbers (bool): Whether to remove numeric characters.
 
     Returns:
-        str: The text without emoji characters.
+        Callable[[str], str]: The function stripping a token, or None if nothing is stripped.
     """
-    return emoji.replace_emoji(text)
+    if strip_punctuations and strip_numbers and not strip_emoji:
+        steps = [_strip_punctuations_and_numbers]
+    else:
+        steps = [step for (selected, step) in (
+            (strip_punctuations, _strip_punctuations),
+            (strip_emoji, _strip_emoji),
+            (strip_numbers, _strip_numbers),
+        ) if selected]
+
+    if not steps:
+        return None
 
+    @lru_cache(maxsize=_TOKEN_CACHE_SIZE)
+    def strip(token):
+        for step in steps:
+            token = step(token)
+        return token
 
+    return strip
+
+
+@lru_cache(maxsize=_TOKEN_CACHE_SIZE)
 def _lemmatize(token):
     """
     Lemmatize a token using hazm.
@@ -102,6 +143,45 @@ def _lemmatize(token):
     return _lemmatizer.lemmatize(token).strip()
 
 
+def tokenize_batch(
+        contents: Iterable[str],
+        normalize=True,
+        lemmatize=True,
+        filter_stopwords=True,
+        strip_punctuations=True,
+        strip_emoji=True,
+        strip_numbers=False,
+) -> Iterator[list[str]]:
+    """
+    Tokenize several contents with the same preprocessing options, lazily one content at a time.
+
+    The preprocessing steps are selected once for all of the contents, and the tokens of
+    each content go through them in list comprehensions rather than chained iterators.
+    The options are the same as `tokenize`.
+
+    Args:
+        contents (Iterable[str]): The text contents to tokenize.
+
+    Yields:
+        list[str]: The processed tokens of each content, in order.
+    """
+    strip = _get_strip_function(strip_punctuations, strip_emoji, strip_numbers)
+    stopwords = _stopwords if filter_stopwords else frozenset()
+
+    for content in contents:
+        if normalize:
+            content = _normalizer.normalize(content)
+        tokens = _word_tokenizer.tokenize(content)
+
+        if strip is not None:
+            tokens = [strip(t) for t in tokens]
+        if lemmatize:
+            tokens = [token for t in tokens if t not in stopwords and (token := _lemmatize(t))]
+        else:
+            tokens = [t for t in tokens if t and t not in stopwords]
+        yield tokens
+
+
 def tokenize(
         content,
         normalize=True,
@@ -130,21 +210,29 @@ def tokenize(
         >>> list(tokenize("این یک متن آزمایشی است."))
         ['این', 'یک', 'متن', 'آزمایشی', 'است']
     """
+    return iter(next(tokenize_batch(
+        [content],
+        normalize=normalize,
+        lemmatize=lemmatize,
+        filter_stopwords=filter_stopwords,
+        strip_punctuations=strip_punctuations,
+        strip_emoji=strip_emoji,
+        strip_numbers=strip_numbers,
+    )))
+
+
+@lru_cache(maxsize=2 ** 16)
+def tokenize_cached(content) -> tuple[str, ...]:
+    """
+    Tokenize content with the default preprocessing options and memoize the result.
 
-    if normalize:
-        content = _normalizer.normalize(content)
-    tokens = hazm.word_tokenize(content)
+    Meant for short texts that repeat across documents (such as tags), where the same
+    content would otherwise go through the whole preprocessing pipeline again.
 
-    if strip_punctuations:
-        tokens = map(_strip_punctuations, tokens)
-    if strip_emoji:
-        tokens = map(_strip_emoji, tokens)
-    if strip_numbers:
-        tokens = map(_strip_numbers, tokens)
-    if filter_stopwords:
-        tokens = filter(_filter_stopwords, tokens)
-    if lemmatize:
-        tokens = map(_lemmatize, tokens)
+    Args:
+        content (str): The text content to tokenize.
 
-    tokens = filter(lambda t: len(t) > 0, tokens)
-    return tokens
+    Returns:
+        tuple[str, ...]: The processed tokens.
+    """
+    return tuple(tokenize(content))
@@ -1,4 +1,9 @@
+from bisect import bisect_left
 from datetime import datetime
+from functools import lru_cache
+import re
+
+import numpy as np
 
 
 def binary_search_tuple(a, x):
@@ -6,6 +11,8 @@ def binary_search_tuple(a, x):
     Perform a binary search on a list of tuples to find the second value
     associated with a given first value.
 
+    The search is done by `bisect.bisect_left`, in C.
+
     Args:
         a (list of tuples): A sorted list of tuples where each tuple contains
                         a key as the first element and a value as the second element.
@@ -25,22 +32,70 @@ def binary_search_tuple(a, x):
         >>> binary_search_tuple(l, 4)
         KeyError: '4 Not found!'
     """
-    low = 0
-    high = len(a) - 1
-    while low < high:
-        mid = (low + high) // 2
-        if a[mid][0] < x:
-            low = mid + 1
-        else:
-            high = mid
-
-    if a[low][0] == x:
-        return a[low][1]
+    # (x,) sorts right before any (x, value), so values are never compared
+    i = bisect_left(a, (x,))
+    if i < len(a) and a[i][0] == x:
+        return a[i][1]
     else:
         raise KeyError(f"{x} Not found!")
 
 
+def top_k_positions(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Selects the positions of the `k` largest scores with `np.partition`, in linear time.
+
+    Of the ties on the k-th largest score, the first ones are selected, like a stable sort would.
+
+    Args:
+        scores (np.ndarray): The scores to select from.
+        k (int): The number of positions to select (none if not positive).
+
+    Returns:
+        np.ndarray: The selected positions, in increasing order.
+    """
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if k >= scores.size:
+        return np.arange(scores.size)
+
+    kth = np.partition(scores, -k)[-k]
+    above = np.flatnonzero(scores > kth)
+    ties = np.flatnonzero(scores == kth)[:k - len(above)]
+    return np.sort(np.concatenate((above, ties)))
+
+
+# The (far most common) zero-padded or not, upper case form of '%m/%d/%Y %I:%M:%S %p';
+# only ASCII digits, like `datetime.strptime` accepts
+_DATE_PATTERN = re.compile(r'([0-9]{1,2})/([0-9]{1,2})/([0-9]{4}) ([0-9]{1,2}):([0-9]{1,2}):([0-9]{1,2}) ([AP])M')
+
+
+@lru_cache(maxsize=100_000)
 def parse_date(date: str, default: datetime):
+    """
+    Parse a date in the '%m/%d/%Y %I:%M:%S %p' format (e.g. '6/28/2024 5:35:28 PM').
+
+    Dates in the common form are parsed with a precompiled pattern instead of `datetime.strptime`,
+    which falls back for anything else. Results are memoized, so a date repeated across documents,
+    or parsed again by `score_weight.date_score`, is only parsed once.
+
+    Args:
+        date (str): The date to parse.
+        default (datetime): The value to return if the date is invalid.
+
+    Returns:
+        datetime: The parsed date, or `default` if it is invalid.
+    """
+    match = _DATE_PATTERN.fullmatch(date) if isinstance(date, str) else None
+    if match is not None:
+        month, day, year, hour, minute, second, period = match.groups()
+        hour = int(hour)
+        if 1 <= hour <= 12:
+            hour = hour % 12 + (12 if period == 'P' else 0)
+            try:
+                return datetime(int(year), int(month), int(day), hour, int(minute), int(second))
+            except ValueError:
+                return default
+
     try:
         return datetime.strptime(date, '%m/%d/%Y %I:%M:%S %p')
     except ValueError: